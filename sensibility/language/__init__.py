@@ -107,9 +107,23 @@ class Language(ABC):
     @abstractmethod
     def tokenize(self, source: Union[str, bytes, IO[bytes]]) -> Iterable[Token]: ...
 
+    def tokenize_batch(self, sources: Sequence[bytes]) -> Sequence[Iterable[Token]]:
+        """
+        Tokenizes several sources at once. Languages with an expensive
+        round trip to their tokenizer should override this.
+        """
+        return [self.tokenize(source) for source in sources]
+
     @abstractmethod
     def check_syntax(self, source: Union[str, bytes]) -> bool: ...
 
+    def check_syntax_batch(self, sources: Sequence[bytes]) -> Sequence[bool]:
+        """
+        Checks the syntax of several sources at once. Languages with an
+        expensive round trip to their parser should override this.
+        """
+        return [self.check_syntax(source) for source in sources]
+
     @abstractmethod
     def summarize_tokens(self, tokens: Iterable[Token]) -> SourceSummary: ...
 
@@ -221,9 +235,15 @@ class LanguageProxy(Language):
     def tokenize(self, *args):
         return self.wrapped_language.tokenize(*args)
 
+    def tokenize_batch(self, *args):
+        return self.wrapped_language.tokenize_batch(*args)
+
     def check_syntax(self, *args):
         return self.wrapped_language.check_syntax(*args)
 
+    def check_syntax_batch(self, *args):
+        return self.wrapped_language.check_syntax_batch(*args)
+
     def summarize_tokens(self, *args):
         return self.wrapped_language.summarize_tokens(*args)
 
@@ -19,12 +19,15 @@
 Language definition for JavaScript.
 """
 
-import json
+import os
+import struct
 import subprocess
-import tempfile
-from io import StringIO, IOBase
+import threading
+from functools import lru_cache
+from io import IOBase
+from itertools import accumulate
 from pathlib import Path
-from typing import Any, Callable, IO, Iterable, Sequence, Tuple, Union
+from typing import Callable, Dict, IO, Iterable, Iterator, List, Sequence, Tuple, Union
 from typing import cast
 
 from sensibility.language import Language, SourceSummary
@@ -34,6 +37,14 @@ here = Path(__file__).parent
 esprima_bin = here / 'esprima-interface'
 assert esprima_bin.exists()
 
+# Token types in the packed format; keep in sync with index.js.
+TOKEN_TYPES = (
+    'Boolean', 'Identifier', 'Keyword', 'Null', 'Numeric', 'Punctuator',
+    'String', 'RegularExpression', 'Template',
+)
+# type, start line, start column, end line, end column, code points in value.
+TOKEN_HEADER = struct.Struct('<BIIIII')
+
 
 class JavaScript(Language):
     extensions = {'.js'}
@@ -46,98 +57,244 @@ class JavaScript(Language):
         >>> len(tokens)
         2
         """
+        tokens, = esprima.tokenize([as_bytes(source)])
+        return tokens
 
-        with SafeSourceFile(source) as source_file:
-            status = _tokenize(source_file)
+    def tokenize_batch(self, sources: Sequence[bytes]) -> List['PackedTokens']:
+        """
+        Tokenizes several JavaScript files in one request to Esprima.
 
-        return [
-            from_esprima_format(tok)
-            for tok in json.loads(status.stdout.decode('UTF-8'))
-        ]
+        >>> [len(tokens) for tokens in javascript.tokenize_batch([b'$', b'f()'])]
+        [1, 3]
+        """
+        return esprima.tokenize([as_bytes(source) for source in sources])
 
     def check_syntax(self, source: Union[str, bytes]) -> bool:
-        with SafeSourceFile(source) as source_file:
-            status = subprocess.run((str(esprima_bin), '--check-syntax'),
-                                    check=False,
-                                    stdin=source_file,
-                                    stdout=subprocess.PIPE)
-        return status.returncode == 0
+        result, = esprima.check_syntax([as_bytes(source)])
+        return result
 
-    def summarize_tokens(self, source: Iterable[Token]) -> SourceSummary:
-        tokens = list(source)
-        unique_lines = set(lineno for token in tokens
-                           for lineno in token.lines)
+    def check_syntax_batch(self, sources: Sequence[bytes]) -> List[bool]:
+        """
+        Checks the syntax of several JavaScript files in one request to
+        Esprima.
 
-        return SourceSummary(sloc=len(unique_lines), n_tokens=len(tokens))
+        >>> javascript.check_syntax_batch([b'f()', b'f(', b''])
+        [True, False, True]
+        """
+        return esprima.check_syntax([as_bytes(source) for source in sources])
+
+    def summarize_tokens(self, source: Iterable[Token]) -> SourceSummary:
+        if isinstance(source, PackedTokens):
+            return summarize_line_spans(source.line_spans())
+        return summarize_line_spans([(token.start.line, token.end.line)
+                                     for token in source])
 
     def vocabularize_tokens(self, tokens: Iterable[Token]) -> Iterable[Tuple[Location, str]]:
         for token in tokens:
-            yield token.location, stringify_lexeme(token)
-
-
-class SafeSourceFile:
+            name = token.name
+            if name in CONSTANT_ENTRIES:
+                entry = CONSTANT_ENTRIES[name]
+            elif name == 'Template':
+                # Template text seldom repeats; keep it out of the cache.
+                entry = stringify_lexeme(token)
+            else:
+                entry = stringify_text(name, token.value)
+            yield token.location, entry
+
+
+def summarize_line_spans(spans: Sequence[Tuple[int, int]]) -> SourceSummary:
     """
-    Context manager that always yields a IO[bytes] object, and safely closes
-    it if it was created here.
+    Summarizes tokens given only their (start line, end line) pairs.
+
+    >>> summarize_line_spans([(1, 1), (1, 1), (3, 5)])
+    SourceSummary(sloc=4, n_tokens=3)
     """
+    unique_lines = set(start for start, _end in spans)
+    for start, end in spans:
+        if end > start:
+            unique_lines.update(range(start + 1, end + 1))
+    return SourceSummary(sloc=len(unique_lines), n_tokens=len(spans))
+
 
-    def __init__(self, source: Union[str, bytes, IO[bytes]]) -> None:
-        self.source = source
-        self._owned: IO[bytes] = None
-        self._foreign: IO[bytes] = None
+def as_bytes(source: Union[str, bytes, IO[bytes]]) -> bytes:
+    """
+    Returns the source as UTF-8 bytes, ready to send to Esprima.
 
-    def __enter__(self) -> IO[bytes]:
-        if isinstance(self.source, (str, bytes)):
-            self._owned = synthetic_file(self.source)
-        elif isinstance(self.source, IOBase):
-            self._foreign = self.source
-        else:
-            raise ValueError(self.source)
+    >>> as_bytes('ಠ_ಠ')
+    b'\\xe0\\xb2\\xa0_\\xe0\\xb2\\xa0'
+    """
+    if isinstance(source, bytes):
+        return source
+    elif isinstance(source, str):
+        return source.encode('UTF-8')
+    elif isinstance(source, IOBase):
+        return source.read()
+    else:
+        raise ValueError(source)
 
-        return self._owned or self._foreign
 
-    def __exit__(self, *exc_info: Any) -> None:
-        if self._owned is not None:
-            self._owned.close()
-        else:
-            assert self._foreign is not None
+class EsprimaError(RuntimeError):
+    pass
 
 
-def synthetic_file(source: Union[str, bytes]) -> IO[bytes]:
+class EsprimaServer:
     """
-    Creates a true file, readable-file with the given contents.
+    A long-running Esprima process, so that Node.js's startup cost is paid
+    once per Python process, rather than once per file.
+
+    Requests are serialized with a lock, so threads may share one server. A
+    forked child notices that it is not the process that started the server,
+    and starts its own.
     """
-    file_obj = tempfile.TemporaryFile(mode='w+b')
-    if isinstance(source, str):
-        file_obj.write(source.encode('UTF-8'))
-    else:
-        file_obj.write(source)
-    file_obj.flush()
-    file_obj.seek(0)
-    return file_obj
 
+    def __init__(self) -> None:
+        self._process: subprocess.Popen = None
+        self._pid: int = None
+        self._lock = threading.Lock()
+
+    def tokenize(self, sources: Sequence[bytes]) -> List['PackedTokens']:
+        return [PackedTokens(payload) for payload in self.request(b't', sources)]
+
+    def check_syntax(self, sources: Sequence[bytes]) -> List[bool]:
+        return [payload == b'\x01' for payload in self.request(b'c', sources)]
 
-def _tokenize(file_obj: IO[bytes]) -> subprocess.CompletedProcess:
+    def request(self, command: bytes, sources: Sequence[bytes]) -> List[bytes]:
+        """
+        Sends a batch of length-prefixed source files; returns the payload of
+        the reply for each source, in order.
+        """
+        with self._lock:
+            process = self._ensure_started()
+            try:
+                process.stdin.write(command + _uint32(len(sources)))
+                for source in sources:
+                    process.stdin.write(_uint32(len(source)))
+                    process.stdin.write(source)
+                process.stdin.flush()
+                replies = [self._read_reply(process.stdout) for _ in sources]
+            except BaseException:
+                # A half-written request or half-read reply leaves the server
+                # out of sync with us; start afresh next time.
+                self._process = None
+                process.kill()
+                _close_pipes(process)
+                raise
+
+        for status, payload in replies:
+            if status != REPLY_OK:
+                raise EsprimaError(payload.decode('UTF-8'))
+        return [payload for _status, payload in replies]
+
+    @staticmethod
+    def _read_reply(file_obj: IO[bytes]) -> Tuple[int, bytes]:
+        status, size = REPLY_HEADER.unpack(_read_exactly(file_obj, REPLY_HEADER.size))
+        return status, _read_exactly(file_obj, size)
+
+    def _ensure_started(self) -> subprocess.Popen:
+        if (self._process is not None and self._pid == os.getpid() and
+                self._process.poll() is not None):
+            # The server died between requests.
+            _close_pipes(self._process)
+            self._process = None
+        if self._process is None or self._pid != os.getpid():
+            self._process = subprocess.Popen([str(esprima_bin), '--server'],
+                                             stdin=subprocess.PIPE,
+                                             stdout=subprocess.PIPE)
+            self._pid = os.getpid()
+        return self._process
+
+
+# status, length of payload.
+REPLY_HEADER = struct.Struct('<BI')
+REPLY_OK = 0
+
+
+def _close_pipes(process: subprocess.Popen) -> None:
     """
-    Tokenizes a (real!) bytes file using Esprima.
+    Reaps a server that has been killed (or has exited) and closes our ends
+    of its pipes.
     """
-    return subprocess.run([str(esprima_bin)],
-                          check=True,
-                          stdin=file_obj,
-                          stdout=subprocess.PIPE)
+    process.wait()
+    for pipe in process.stdin, process.stdout:
+        try:
+            pipe.close()
+        except OSError:
+            # Flushing whatever was left of the request fails now that
+            # nothing is reading it.
+            pass
+
+
+def _uint32(n: int) -> bytes:
+    return n.to_bytes(4, 'little')
 
 
-def from_esprima_format(token) -> Token:
+def _read_exactly(file_obj: IO[bytes], size: int) -> bytes:
+    data = file_obj.read(size)
+    if len(data) != size:
+        raise EsprimaError('Esprima server exited unexpectedly')
+    return data
+
+
+class PackedTokens(Sequence[Token]):
     """
-    Parses the Esprima's token format
+    Tokens in the packed format sent by the Esprima server. Token objects
+    are only created as they are accessed.
+
+    >>> tokens = javascript.tokenize('let ಠ_ಠ')
+    >>> tokens[1]
+    Token(name='Identifier', value='ಠ_ಠ', start=Position(line=1, column=4), end=Position(line=1, column=7))
+    >>> [token.value for token in tokens]
+    ['let', 'ಠ_ಠ']
     """
-    loc = token['loc']
-    return Token(name=token['type'],
-                 value=token['value'],
-                 start=Position(line=loc['start']['line'],
-                                column=loc['start']['column']),
-                 end=Position(line=loc['end']['line'],
-                              column=loc['end']['column']))
+
+    def __init__(self, payload: bytes) -> None:
+        count, = struct.unpack_from('<I', payload)
+        values_start = 4 + count * TOKEN_HEADER.size
+        view = memoryview(payload)
+        self._headers = list(TOKEN_HEADER.iter_unpack(view[4:values_start]))
+        self._values = str(view[values_start:], 'UTF-8')
+        self._offsets = [0]
+        self._offsets.extend(accumulate(header[5] for header in self._headers))
+
+    def __len__(self) -> int:
+        return len(self._headers)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+            if index < 0:
+                raise IndexError('token index out of range')
+        type_id, start_line, start_col, end_line, end_col, _ = self._headers[index]
+        return Token(name=TOKEN_TYPES[type_id],
+                     value=self._values[self._offsets[index]:self._offsets[index + 1]],
+                     start=Position(line=start_line, column=start_col),
+                     end=Position(line=end_line, column=end_col))
+
+    def __iter__(self) -> Iterator[Token]:
+        values = self._values
+        offsets = self._offsets
+        for index, header in enumerate(self._headers):
+            type_id, start_line, start_col, end_line, end_col, _ = header
+            yield Token(name=TOKEN_TYPES[type_id],
+                        value=values[offsets[index]:offsets[index + 1]],
+                        start=Position(line=start_line, column=start_col),
+                        end=Position(line=end_line, column=end_col))
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def line_spans(self) -> List[Tuple[int, int]]:
+        """
+        The start and end line of every token, without creating tokens.
+        """
+        return [(start_line, end_line)
+                for _, start_line, _, end_line, _, _ in self._headers]
+
+    def __reduce__(self):
+        # Pickle plain tokens, so that unpickling does not need this class.
+        return list, (list(self),)
 
 
 class StringifyLexeme:
@@ -170,10 +327,19 @@ class StringifyLexeme:
     '<NUMBER>'
     """
 
+    def __init__(self) -> None:
+        # Resolve the handlers once, rather than calling getattr() per token.
+        self._handlers: Dict[str, Callable[[str], str]] = {
+            name: getattr(self, name) for name in (
+                'Boolean', 'Identifier', 'Keyword', 'Null', 'Numeric',
+                'Punctuator', 'String', 'RegularExpression', 'Template',
+            )
+        }
+
     def __call__(self, token) -> str:
         try:
-            fn = getattr(self, token.name)
-        except AttributeError:
+            fn = self._handlers[token.name]
+        except KeyError:
             raise TypeError(f'Unhandled type: {token.name}')
         return fn(token.value)
 
@@ -201,21 +367,40 @@ class StringifyLexeme:
     def RegularExpression(self, text):
         return '<REGEXP>'
 
+    # Indexed by (starts with '}') * 2 + (ends with '${').
+    TEMPLATE_KINDS = (
+        '<STANDALONE-TEMPLATE>', '<TEMPLATE-HEAD>',
+        '<TEMPLATE-TAIL>', '<TEMPLATE-MIDDLE>',
+    )
+
     def Template(self, text):
         assert len(text) >= 2
-        if text.startswith('`'):
-            if text.endswith('`'):
-                return '<STANDALONE-TEMPLATE>'
-            elif text.endswith('${'):
-                return '<TEMPLATE-HEAD>'
-        elif text.startswith('}'):
-            if text.endswith('`'):
-                return '<TEMPLATE-TAIL>'
-            elif text.endswith('${'):
-                return '<TEMPLATE-MIDDLE>'
-        raise TypeError('Unhandled template literal: ' + text)
+        first, last = text[0], text[-1]
+        if first not in '`}' or last not in '`{':
+            raise TypeError('Unhandled template literal: ' + text)
+        return self.TEMPLATE_KINDS[(first == '}') * 2 + (last == '{')]
 
 
 # The main exports.
+esprima = EsprimaServer()
 javascript = JavaScript()
 stringify_lexeme = cast(Callable[[Lexeme], str], StringifyLexeme())
+
+# Vocabulary entries that do not depend on the lexeme's text.
+CONSTANT_ENTRIES = {
+    name: stringify_lexeme(Lexeme(name=name, value=''))
+    for name in ('Identifier', 'Null', 'Numeric', 'RegularExpression', 'String')
+}
+
+
+@lru_cache(maxsize=4096)
+def stringify_text(name: str, value: str) -> str:
+    """
+    Memoized stringify_lexeme() for keywords, punctuators and booleans,
+    whose entries are their text. There are few of them, and they repeat a
+    lot.
+
+    >>> stringify_text('Punctuator', '=>')
+    '=>'
+    """
+    return stringify_lexeme(Lexeme(name=name, value=value))
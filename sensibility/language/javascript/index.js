@@ -17,31 +17,202 @@
 
 'use strict';
 
+const crypto = require('crypto');
 const fs = require('fs');
 const esprima = require('esprima');
 
+/* Token types in the packed format; keep in sync with __init__.py. */
+const TOKEN_TYPES = [
+  'Boolean', 'Identifier', 'Keyword', 'Null', 'Numeric', 'Punctuator',
+  'String', 'RegularExpression', 'Template'
+];
+const TOKEN_HEADER_SIZE = 21;
+
+const OK = 0;
+const ERROR = 1;
+
+/*
+ * Source types of recently checked sources, so that checking the syntax of a
+ * file and then tokenizing it only parses the file once. Keyed by a digest of
+ * the source, so that the sources themselves are not kept alive.
+ *
+ * bin/parse-and-insert-all checks a whole batch of BATCH_SIZE files before
+ * tokenizing any of them, so this must stay at least as large as BATCH_SIZE
+ * or the cache misses on every file.
+ */
+const recentSourceTypes = new Map();
+const MAX_RECENT_SOURCE_TYPES = 128;
+
 module.exports.tokenize = tokenize;
 module.exports.checkSyntax = checkSyntax;
 
 
 if (require.main === module) {
-  const source = fs.readFileSync('/dev/stdin', 'utf8');
-  const shouldCheckSyntax =
-    process.argv.slice(2).indexOf('--check-syntax') >= 0;
-  if (shouldCheckSyntax) {
-    process.exit(checkSyntax(source) ? 0 : 1);
+  const args = process.argv.slice(2);
+  if (args.indexOf('--server') >= 0) {
+    serve();
   } else {
-    console.log(JSON.stringify(tokenize(source)));
+    const source = fs.readFileSync('/dev/stdin', 'utf8');
+    if (args.indexOf('--check-syntax') >= 0) {
+      process.exit(checkSyntax(source) ? 0 : 1);
+    } else {
+      console.log(JSON.stringify(tokenize(source)));
+    }
+  }
+}
+
+
+/**
+ * Serves requests on stdin until it is closed.
+ *
+ * Each request is a one byte command (t: tokenize; c: check syntax), followed
+ * by the number of sources in the batch, then each source as its length
+ * followed by its UTF-8 bytes. All integers are little-endian uint32.
+ *
+ * The reply has, for each source in order, a status byte (0: OK; 1: error),
+ * the length of the payload, and the payload itself. The payload of tokenize
+ * is packed by packTokens(); check syntax replies with one byte (0 or 1);
+ * errors reply with a UTF-8 message.
+ */
+function serve() {
+  const commands = {
+    t: source => packTokens(tokenize(source)),
+    c: source => Buffer.from([checkSyntax(source) ? 1 : 0])
+  };
+  const push = requestReader((command, sources) => {
+    respond(commands[command], sources);
+  });
+
+  process.stdin.on('data', push);
+}
+
+/**
+ * Returns a function that reassembles requests from the chunks that arrive
+ * on stdin, calling onRequest(command, sources) for each complete request.
+ *
+ * Chunks are only joined once enough bytes have arrived for the next field
+ * (header, length, or source), so each byte is copied about once, and each
+ * source is decoded exactly once.
+ */
+function requestReader(onRequest) {
+  let chunks = [];
+  let length = 0;
+  let needed, field;
+  let command, remaining, sources;
+
+  function take(size) {
+    const buffer = chunks.length === 1 ? chunks[0] : Buffer.concat(chunks, length);
+    const rest = buffer.slice(size);
+    chunks = rest.length > 0 ? [rest] : [];
+    length = rest.length;
+    return buffer.slice(0, size);
+  }
+
+  function expectHeader() {
+    needed = 5;
+    field = data => {
+      command = String.fromCharCode(data[0]);
+      remaining = data.readUInt32LE(1);
+      sources = [];
+      expectLengthOrFinish();
+    };
+  }
+
+  function expectLengthOrFinish() {
+    if (remaining === 0) {
+      const request = sources;
+      expectHeader();
+      onRequest(command, request);
+      return;
+    }
+
+    needed = 4;
+    field = data => {
+      needed = data.readUInt32LE(0);
+      field = source => {
+        sources.push(source.toString('utf8'));
+        remaining--;
+        expectLengthOrFinish();
+      };
+    };
+  }
+
+  expectHeader();
+  return chunk => {
+    chunks.push(chunk);
+    length += chunk.length;
+    while (length >= needed) {
+      field(take(needed));
+    }
+  };
+}
+
+function respond(command, sources) {
+  const replies = [];
+
+  for (const source of sources) {
+    let status, payload;
+    try {
+      payload = command(source);
+      status = OK;
+    } catch (e) {
+      payload = Buffer.from(String(e), 'utf8');
+      status = ERROR;
+    }
+
+    const header = Buffer.alloc(5);
+    header.writeUInt8(status, 0);
+    header.writeUInt32LE(payload.length, 1);
+    replies.push(header, payload);
   }
+
+  process.stdout.write(Buffer.concat(replies));
+}
+
+/**
+ * Packs tokens as the number of tokens, then a fixed-size header for each
+ * token, then the UTF-8 values of all tokens, back to back. Each header is
+ * the type (uint8, an index into TOKEN_TYPES), the start line, start column,
+ * end line, end column, and the length of the value in code points (all
+ * uint32). Code points, so that Python can decode all of the values at once
+ * and slice them apart.
+ */
+function packTokens(tokens) {
+  const values = Buffer.from(tokens.map(token => token.value).join(''), 'utf8');
+  const headers = Buffer.alloc(4 + tokens.length * TOKEN_HEADER_SIZE);
+
+  headers.writeUInt32LE(tokens.length, 0);
+  tokens.forEach((token, i) => {
+    const type = TOKEN_TYPES.indexOf(token.type);
+    if (type < 0) {
+      throw new Error(`Unknown token type: ${token.type}`);
+    }
+
+    const {start, end} = token.loc;
+    let offset = 4 + i * TOKEN_HEADER_SIZE;
+    offset = headers.writeUInt8(type, offset);
+    offset = headers.writeUInt32LE(start.line, offset);
+    offset = headers.writeUInt32LE(start.column, offset);
+    offset = headers.writeUInt32LE(end.line, offset);
+    offset = headers.writeUInt32LE(end.column, offset);
+    headers.writeUInt32LE(codePointLength(token.value), offset);
+  });
+
+  return Buffer.concat([headers, values]);
 }
 
+function codePointLength(text) {
+  const surrogatePairs = text.match(/[\uD800-\uDBFF][\uDC00-\uDFFF]/g);
+  return text.length - (surrogatePairs === null ? 0 : surrogatePairs.length);
+}
 
 function tokenize(source) {
   source = removeShebangLine(source);
 
   /* TODO: retry on illegal tokens. */
 
-  const sourceType = deduceSourceType(source);
+  const sourceType = recentSourceTypes.get(digest(source)) ||
+    deduceSourceType(source);
   const tokens = esprima.tokenize(source, {
     sourceType,
     loc: true,
@@ -51,16 +222,35 @@ function tokenize(source) {
   return tokens;
 }
 
+function digest(source) {
+  return crypto.createHash('sha1').update(source).digest('base64');
+}
+
 function checkSyntax(source) {
   source = removeShebangLine(source);
-  const sourceType = deduceSourceType(source);
+  return validSourceType(source) !== null;
+}
 
-  try {
-    esprima.parse(source, { sourceType });
-    return true;
-  } catch (e) {
-    return false;
+/**
+ * Returns the source type ('script' or 'module') that the source parses as,
+ * or null if it does not parse at all.
+ */
+function validSourceType(source) {
+  let sourceType = deduceSourceType(source);
+  if (sourceType === 'module') {
+    try {
+      esprima.parse(source, { sourceType });
+    } catch (e) {
+      sourceType = null;
+    }
+  }
+
+  recentSourceTypes.set(digest(source), sourceType);
+  if (recentSourceTypes.size > MAX_RECENT_SOURCE_TYPES) {
+    /* Maps iterate in insertion order, so this is the oldest entry. */
+    recentSourceTypes.delete(recentSourceTypes.keys().next().value);
   }
+  return sourceType;
 }
 
 /**
@@ -118,7 +118,10 @@ class Token(Lexeme):
     __slots__ = 'start', 'end'
 
     def __init__(self, *, name: str, value: str, start: Position, end: Position) -> None:
-        super().__init__(name=name, value=value)
+        # Assigned directly, rather than through Lexeme.__init__(): tokenizers
+        # create one token per lexeme, so the extra call adds up.
+        self.name = name
+        self.value = value
         self.start = start
         self.end = end
 
@@ -19,7 +19,7 @@
 Access to the corpus.
 """
 
-from typing import Any, Dict, Set
+from typing import Any, Dict, Iterable, Mapping, Set
 from pathlib import PurePosixPath
 
 from sqlalchemy import create_engine, event, MetaData  # type: ignore
@@ -180,6 +180,30 @@ class Corpus:
                           hash=filehash,
                           sloc=summary.sloc, n_tokens=summary.n_tokens)
 
+    def insert_parse_results(self, summaries: Mapping[str, SourceSummary],
+                             failures: Iterable[str]) -> None:
+        """
+        Insert many source summaries and failures in one transaction.
+        """
+        summary_rows = [
+            {'hash': filehash,
+             'sloc': summary.sloc, 'n_tokens': summary.n_tokens}
+            for filehash, summary in summaries.items()
+        ]
+        failure_rows = [{'hash': filehash} for filehash in failures]
+
+        trans = self.conn.begin()
+        try:
+            if summary_rows:
+                self.conn.execute(source_summary.insert(), summary_rows)
+            if failure_rows:
+                self.conn.execute(failure.insert(), failure_rows)
+        except:
+            trans.rollback()
+            raise
+        else:
+            trans.commit()
+
     def insert_failure(self, filehash: str) -> None:
         """
         Insert the word count into the source summary.
@@ -195,6 +219,15 @@ class Corpus:
         result, = self.conn.execute(query)
         return result[source_file.c.source]
 
+    def get_sources(self, filehashes: Iterable[str]) -> Dict[str, bytes]:
+        """
+        Returns the source code for several files, keyed by filehash.
+        """
+        query = select([source_file.c.hash, source_file.c.source])\
+            .where(source_file.c.hash.in_(list(filehashes)))
+        return {row[source_file.c.hash]: row[source_file.c.source]
+                for row in self.conn.execute(query)}
+
     def get_info(self, filehash: str) -> FileInfo:
         # Do an intense query, combining multiple tables.
         query = select([source_summary, repository_source, repository]).select_from(
@@ -20,7 +20,10 @@ Miscellaneous filehashes
 """
 
 import sys
-from typing import Iterator
+from itertools import islice
+from typing import Iterable, Iterator, List, TypeVar
+
+T = TypeVar('T')
 
 
 def filehashes(file=sys.stdin) -> Iterator[str]:
@@ -33,3 +36,18 @@ def filehashes(file=sys.stdin) -> Iterator[str]:
         filehash = line.strip()
         if filehash:
             yield filehash
+
+
+def batches(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """
+    Yields lists of at most size items from the iterable.
+
+    >>> list(batches(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
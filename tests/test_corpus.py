@@ -25,6 +25,7 @@ from sqlalchemy.sql import select  # type: ignore
 # This is the WRONG place to store the WordCount class!
 from sensibility.language import SourceSummary
 from sensibility.miner.corpus import Corpus
+from sensibility.miner._schema import failure, source_summary
 from sensibility.miner.models import (
     RepositoryMetadata, SourceFile,
     SourceFileInRepository
@@ -43,6 +44,50 @@ def test_insert_source_summary(empty_corpus, repo_file) -> None:
                                        SourceSummary(2, 3))
 
 
+def test_insert_parse_results(corpus, source_file) -> None:
+    corpus.insert_parse_results({source_file.filehash: SourceSummary(2, 3)},
+                                failures=[])
+    info = corpus.get_info(source_file.filehash)
+    assert info.summary == SourceSummary(2, 3)
+
+
+def test_insert_parse_results_with_failures(corpus, repo_file) -> None:
+    invalid_file = insert_invalid_file(corpus, repo_file)
+    corpus.insert_parse_results({repo_file.filehash: SourceSummary(2, 3)},
+                                failures=[invalid_file.filehash])
+    assert corpus.get_info(repo_file.filehash).summary == SourceSummary(2, 3)
+    failed = corpus.conn.execute(select([failure.c.hash])).fetchall()
+    assert failed == [(invalid_file.filehash,)]
+
+
+def test_insert_parse_results_is_atomic(corpus, repo_file) -> None:
+    """
+    When any row cannot be inserted, none of them are.
+    """
+    invalid_file = insert_invalid_file(corpus, repo_file)
+    with pytest.raises(Exception):
+        # The duplicate violates failure's primary key.
+        corpus.insert_parse_results({repo_file.filehash: SourceSummary(2, 3)},
+                                    failures=[invalid_file.filehash,
+                                              invalid_file.filehash])
+    assert corpus.conn.execute(select([source_summary])).fetchall() == []
+    assert corpus.conn.execute(select([failure])).fetchall() == []
+
+
+def insert_invalid_file(corpus: Corpus,
+                        repo_file: SourceFileInRepository) -> SourceFile:
+    """
+    Adds a syntactically-invalid file to the corpus' repository.
+    """
+    invalid_file = SourceFile(source=b'print(\n')
+    corpus.insert_source_file_from_repo(SourceFileInRepository(
+        repository=repo_file.repository,
+        source_file=invalid_file,
+        path=PurePosixPath('invalid.py')
+    ))
+    return invalid_file
+
+
 def test_insert_and_retrieve(corpus, source_file):
     source_code = corpus.get_source(source_file.filehash)
     assert source_code == source_file.source
@@ -51,6 +96,11 @@ def test_insert_and_retrieve(corpus, source_file):
     assert corpus[source_file.filehash] == source_file.source
 
 
+def test_get_sources(corpus, source_file):
+    sources = corpus.get_sources([source_file.filehash, 'not-a-hash'])
+    assert sources == {source_file.filehash: source_file.source}
+
+
 def test_metadata(corpus) -> None:
     assert corpus.language == 'Python'
 
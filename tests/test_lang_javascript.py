@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 # -*- coding: UTF-8 -*-
 
+from pprint import pformat
+
 import pytest  # type: ignore
 
 from sensibility.language import Language
-from sensibility.language.javascript import javascript
+from sensibility.language.javascript import javascript, esprima, EsprimaError
 from sensibility.lexical_analysis import Position
 
 from location_factory import LocationFactory
@@ -30,6 +32,68 @@ def test_tokenize() -> None:
     assert tokens[2].value == 'ಠ_ಠ'
 
 
+def test_tokenize_acts_like_a_list() -> None:
+    """
+    tokenize() returns a Sequence, not necessarily a list, but it should
+    still slice, compare, and pretty-print like one.
+    """
+    tokens = javascript.tokenize('let a = 1;\nf(a);\n')
+    as_list = list(tokens)
+    assert len(as_list) == len(tokens) == 10
+    assert ([(t.name, t.value, t.location) for t in tokens[:]] ==
+            [(t.name, t.value, t.location) for t in as_list])
+    assert ([(t.name, t.value) for t in tokens[-3:]] ==
+            [('Identifier', 'a'), ('Punctuator', ')'), ('Punctuator', ';')])
+    # One token per line, as when tokenize() returned a list.
+    assert pformat(as_list) == pformat(tokens[:])
+    assert len(pformat(as_list).splitlines()) == len(tokens)
+
+
+def test_tokenize_many() -> None:
+    """
+    The Esprima server should handle many requests, including sources that
+    are too large to arrive in one chunk.
+    """
+    large_file = 'var ಠ_ಠ = "-_-";\n' * 10_000
+    assert len(javascript.tokenize(large_file)) == 50_000
+    for _ in range(10):
+        assert len(javascript.tokenize(test_file)) == 7
+
+
+def test_tokenize_batch() -> None:
+    """
+    Batches may span many chunks on the server's stdin, and contain empty
+    sources.
+    """
+    large_file = ('var ಠ_ಠ = "-_-";\n' * 10_000).encode('UTF-8')
+    sources = [large_file, b'', test_file.encode('UTF-8'), large_file]
+    lengths = [len(tokens) for tokens in javascript.tokenize_batch(sources)]
+    assert lengths == [50_000, 0, 7, 50_000]
+
+
+def test_tokens_negative_index() -> None:
+    tokens = javascript.tokenize('f();')
+    assert tokens[-1].value == ';'
+    assert tokens[-4].value == 'f'
+    with pytest.raises(IndexError):
+        tokens[-5]
+    with pytest.raises(IndexError):
+        tokens[4]
+
+
+def test_server_survives_error_reply() -> None:
+    with pytest.raises(EsprimaError):
+        esprima.request(b'x', [b''])
+    assert len(javascript.tokenize('f();')) == 4
+
+
+def test_server_restarts_after_exit() -> None:
+    javascript.tokenize('f();')
+    esprima._process.kill()
+    esprima._process.wait()
+    assert len(javascript.tokenize('f();')) == 4
+
+
 def test_check_syntax() -> None:
     assert not javascript.check_syntax('import #')
     assert javascript.check_syntax(test_file)
@@ -41,6 +105,14 @@ def test_summarize() -> None:
     assert summary.n_tokens == 7
 
 
+def test_summarize_multiline_tokens() -> None:
+    source = 'x = `\n${y}\n`;\n\nz = "\\\n";\n'
+    tokens = javascript.tokenize(source)
+    # Summarizing the packed tokens should agree with summarizing Tokens.
+    assert javascript.summarize(tokens) == javascript.summarize(list(tokens))
+    assert javascript.summarize(tokens).sloc == 5
+
+
 def test_vocabularize() -> None:
     loc = LocationFactory(Position(line=6, column=0))
     result = list(javascript.vocabularize_with_locations(test_file))